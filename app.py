@@ -1,9 +1,19 @@
+import csv
+import io
+import json
 import os
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
+import click
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from models import (db, Patient, Doctor, Appointment, Prescription, MedicalRecord, 
-                   DoctorAvailability, Operation, Income, Message, Medication, Document)
+                   DoctorAvailability, Operation, Income, Message, Medication, Document, AuditLog,
+                   ArchivedAppointment, ArchivedMessage, ArchivedIncome,
+                   APPOINTMENT_TRANSITIONS)
+from audit import audit_writer, record_change
+from archive import run_archival, merge_recent, history_ids
+from snapshot import configure_reporting_bind, reporting_session, snapshot_scheduler, take_snapshot
+from availability import availability_index, days_to_mask, mask_to_days
 # Imports for authentication
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
@@ -16,9 +26,25 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+app.config['AVAILABILITY_MAX_RANGE_DAYS'] = 90
+app.config['AVAILABILITY_INDEX_TTL'] = 30  # seconds before a worker reloads its availability index
+# Archival of finished appointments, read messages and old income rows
+app.config['ARCHIVE_AFTER_DAYS'] = 180
+app.config['ARCHIVE_BATCH_SIZE'] = 500
+app.config['ARCHIVE_BATCH_PAUSE'] = 0.5  # seconds between batches
+app.config['MESSAGES_PER_PAGE'] = 50
+# Online snapshots of the live database and the read-only reporting replica built from them
+app.config['SNAPSHOT_INTERVAL'] = 0  # seconds between scheduled snapshots, 0 disables the scheduler
+app.config['SNAPSHOT_PAGES'] = 256  # pages copied per backup step
+app.config['SNAPSHOT_SLEEP'] = 0.05  # seconds to pause between backup steps
+app.config['SNAPSHOT_KEEP'] = 5
+app.config['REPORTING_USE_SNAPSHOT'] = False  # route reporting queries to the latest snapshot
+configure_reporting_bind(app)
 
 # Initialize extensions
 db.init_app(app)
+audit_writer.init_app(app)
+snapshot_scheduler.init_app(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -39,7 +65,10 @@ def allowed_file(filename):
 
 # --- DATABASE CREATION AND SEEDING ---
 with app.app_context():
-    db.create_all()
+    db.create_all(bind_key=None)  # the reporting bind is a snapshot copy, never created directly
+    # create_all() skips tables that already exist, so add indexes introduced since then
+    for index in DoctorAvailability.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
     if not Doctor.query.first():
         # Create default admin doctor
         hashed_password = bcrypt.generate_password_hash('password').decode('utf-8')
@@ -147,10 +176,12 @@ def welcome():
 @login_required
 def dashboard():
     # Dashboard statistics
-    total_patients = Patient.query.count()
-    total_doctors = Doctor.query.count()
-    total_operations = Operation.query.count()
-    total_income = db.session.query(db.func.sum(Income.amount)).scalar() or 0
+    with reporting_session() as session:
+        total_patients = session.query(db.func.count(Patient.id)).scalar()
+        total_doctors = session.query(db.func.count(Doctor.id)).scalar()
+        total_operations = session.query(db.func.count(Operation.id)).scalar()
+        total_income = (session.query(db.func.sum(Income.amount)).scalar() or 0) + \
+                       (session.query(db.func.sum(ArchivedIncome.amount)).scalar() or 0)
     
     # Recent data
     recent_patients = Patient.query.order_by(Patient.date_registered.desc()).limit(5).all()
@@ -242,11 +273,80 @@ def add_appointment():
 @login_required
 def update_appointment_status(appointment_id, status):
     appointment = Appointment.query.get_or_404(appointment_id)
+    if status not in APPOINTMENT_TRANSITIONS.get(appointment.status, ()):
+        flash(f'Cannot change an appointment from {appointment.status} to {status}.', 'danger')
+        return redirect(url_for('dashboard'))
     appointment.status = status
     db.session.commit()
     flash(f'Appointment {status.lower()}!', 'success')
     return redirect(url_for('dashboard'))
 
+@app.route('/api/appointments/status', methods=['POST'])
+@login_required
+def bulk_update_appointment_status():
+    # Body: {"ids": [1, 2, ...], "status": "Accepted"}; returns a result per requested id
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    status = data.get('status')
+    raw_ids = data.get('ids')
+    if not isinstance(raw_ids, list) or \
+            not all(isinstance(appointment_id, int) and not isinstance(appointment_id, bool) for appointment_id in raw_ids):
+        return jsonify({'error': 'ids must be a list of integers'}), 400
+    ids = list(dict.fromkeys(raw_ids))
+    if status not in APPOINTMENT_TRANSITIONS:
+        return jsonify({'error': f'Unknown status: {status}'}), 400
+    if not ids:
+        return jsonify({'error': 'No appointment ids given'}), 400
+
+    allowed_from = [current for current, targets in APPOINTMENT_TRANSITIONS.items() if status in targets]
+    current_statuses = dict(db.session.query(Appointment.id, Appointment.status).filter(Appointment.id.in_(ids)).all())
+    results = []
+    candidates = {}
+    for appointment_id in ids:
+        current = current_statuses.get(appointment_id)
+        if current is None:
+            results.append({'id': appointment_id, 'ok': False, 'error': 'Appointment not found'})
+        elif current not in allowed_from:
+            results.append({'id': appointment_id, 'ok': False, 'status': current,
+                            'error': f'Cannot change from {current} to {status}'})
+        else:
+            candidates[appointment_id] = current
+            results.append({'id': appointment_id})
+
+    updated_ids = set()
+    if candidates:
+        # One set-based UPDATE; the status guard skips rows another request changed since the SELECT,
+        # so results and audit entries are built only from the ids the UPDATE reports back.
+        result = db.session.execute(
+            db.update(Appointment.__table__)
+            .where(Appointment.id.in_(list(candidates)), Appointment.status.in_(allowed_from))
+            .values(status=status)
+            .returning(Appointment.id)
+        )
+        updated_ids = {row[0] for row in result}
+        for appointment_id in ids:
+            if appointment_id in updated_ids:
+                record_change(db.session, Appointment.__tablename__, appointment_id,
+                              {'status': [candidates[appointment_id], status]})
+        db.session.commit()
+    # Rows that lost a race report their status now, so the dashboard can redraw them
+    lost_ids = [appointment_id for appointment_id in candidates if appointment_id not in updated_ids]
+    latest_statuses = dict(db.session.query(Appointment.id, Appointment.status)
+                           .filter(Appointment.id.in_(lost_ids)).all()) if lost_ids else {}
+    for result in results:
+        appointment_id = result['id']
+        if appointment_id not in candidates:
+            continue
+        if appointment_id in updated_ids:
+            result.update(ok=True, status=status, previous_status=candidates[appointment_id])
+        elif appointment_id in latest_statuses:
+            result.update(ok=False, status=latest_statuses[appointment_id],
+                          error='Appointment was changed by another request')
+        else:
+            result.update(ok=False, error='Appointment not found')
+    return jsonify({'status': status, 'updated': len(updated_ids), 'results': results})
+
 @app.route('/add_prescription', methods=['POST'])
 @login_required
 def add_prescription():
@@ -317,16 +417,24 @@ def logout():
 def manage_availability():
     days_of_week = {0: "Monday", 1: "Tuesday", 2: "Wednesday", 3: "Thursday", 4: "Friday", 5: "Saturday", 6: "Sunday"}
     if request.method == 'POST':
-        selected_days = request.form.getlist('days')
-        DoctorAvailability.query.filter_by(doctor_id=current_user.id).delete()
-        for day in selected_days:
-            new_availability = DoctorAvailability(day_of_week=int(day), doctor_id=current_user.id)
-            db.session.add(new_availability)
+        new_mask = days_to_mask(request.form.getlist('days'))
+        # Diff against the database, not the in-memory index, which may be stale in this process
+        old_mask = days_to_mask(day for (day,) in db.session.query(DoctorAvailability.day_of_week)
+                                .filter(DoctorAvailability.doctor_id == current_user.id).all())
+        # Only touch the days that actually changed instead of rewriting the whole week
+        removed_days = mask_to_days(old_mask & ~new_mask)
+        added_days = mask_to_days(new_mask & ~old_mask)
+        if removed_days:
+            DoctorAvailability.query.filter(DoctorAvailability.doctor_id == current_user.id,
+                                            DoctorAvailability.day_of_week.in_(removed_days)).delete(synchronize_session=False)
+        for day in added_days:
+            db.session.add(DoctorAvailability(day_of_week=day, doctor_id=current_user.id))
         db.session.commit()
+        if removed_days or added_days:
+            availability_index.invalidate()
         flash('Your availability has been updated!', 'success')
         return redirect(url_for('manage_availability'))
-    availability_records = DoctorAvailability.query.filter_by(doctor_id=current_user.id).all()
-    current_availability = [record.day_of_week for record in availability_records]
+    current_availability = mask_to_days(availability_index.mask_for(current_user.id))
     return render_template('manage_availability.html', days=days_of_week, current_availability=current_availability)
 
 
@@ -347,14 +455,27 @@ def patients():
 @app.route('/messages')
 @login_required
 def messages():
-    # Get messages where current user is either sender or receiver
-    received_messages = Message.query.filter_by(receiver_id=current_user.id).order_by(Message.created_at.desc()).all()
-    sent_messages = Message.query.filter_by(sender_id=current_user.id).order_by(Message.created_at.desc()).all()
+    # Get messages where current user is either sender or receiver, one page at a time
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['MESSAGES_PER_PAGE']
+    received_messages, has_more_received = _message_page(page, per_page, receiver_id=current_user.id)
+    sent_messages, has_more_sent = _message_page(page, per_page, sender_id=current_user.id)
     all_doctors = Doctor.query.filter(Doctor.id != current_user.id).all()
     return render_template('messages.html', 
                          received_messages=received_messages, 
                          sent_messages=sent_messages,
-                         all_doctors=all_doctors)
+                         all_doctors=all_doctors,
+                         page=page,
+                         has_more=has_more_received or has_more_sent)
+
+def _message_page(page, per_page, **filters):
+    # Newest-first page across both tiers; each tier only loads the rows this page can need
+    needed = page * per_page + 1
+    rows = merge_recent([
+        Message.query.filter_by(**filters).order_by(Message.created_at.desc()).limit(needed),
+        ArchivedMessage.query.filter_by(**filters).order_by(ArchivedMessage.created_at.desc()).limit(needed)
+    ], 'created_at', limit=needed)
+    return rows[(page - 1) * per_page:page * per_page], len(rows) > page * per_page
 
 @app.route('/send_message', methods=['POST'])
 @login_required
@@ -438,9 +559,10 @@ def delete_medication(medication_id):
 def doctor_profile(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id)
     # Get doctor's recent appointments
-    recent_appointments = Appointment.query.filter_by(doctor_id=doctor_id).order_by(Appointment.created_at.desc()).limit(5).all()
-    # Get doctor's availability
-    availability = DoctorAvailability.query.filter_by(doctor_id=doctor_id).all()
+    recent_appointments = merge_recent([
+        Appointment.query.filter_by(doctor_id=doctor_id).order_by(Appointment.created_at.desc()).limit(5),
+        ArchivedAppointment.query.filter_by(doctor_id=doctor_id).order_by(ArchivedAppointment.created_at.desc()).limit(5)
+    ], 'created_at', limit=5)
     return jsonify({
         'id': doctor.id,
         'name': doctor.name,
@@ -453,13 +575,13 @@ def doctor_profile(doctor_id):
         'phone': doctor.phone,
         'bio': doctor.bio,
         'recent_appointments': [{
-            'id': apt.id,
+            **history_ids(apt),
             'patient_name': apt.patient.name,
             'date': apt.date,
             'time': apt.time,
             'status': apt.status
         } for apt in recent_appointments],
-        'availability': [record.day_of_week for record in availability]
+        'availability': mask_to_days(availability_index.mask_for(doctor_id))
     })
 
 @app.route('/send_message_to_doctor', methods=['POST'])
@@ -484,8 +606,9 @@ def send_message_to_doctor():
 @login_required
 def patient_profile(patient_id):
     patient = Patient.query.get_or_404(patient_id)
-    # Get patient's appointments
-    appointments = Appointment.query.filter_by(patient_id=patient_id).order_by(Appointment.created_at.desc()).all()
+    # Get patient's appointments, including archived ones
+    appointments = merge_recent([Appointment.query.filter_by(patient_id=patient_id),
+                                 ArchivedAppointment.query.filter_by(patient_id=patient_id)], 'created_at')
     # Get patient's medical records
     records = MedicalRecord.query.filter_by(patient_id=patient_id).order_by(MedicalRecord.id.desc()).all()
     # Get patient's prescriptions
@@ -507,7 +630,7 @@ def patient_profile(patient_id):
         'status': patient.status,
         'date_registered': patient.date_registered.strftime('%d %b %Y') if patient.date_registered else None,
         'appointments': [{
-            'id': apt.id,
+            **history_ids(apt),
             'doctor_name': apt.doctor.name,
             'date': apt.date,
             'time': apt.time,
@@ -520,7 +643,7 @@ def patient_profile(patient_id):
             'filename': record.filename
         } for record in records],
         'prescriptions': [{
-            'id': pres.id,
+            **history_ids(pres),
             'medication': pres.medication,
             'dosage': pres.dosage,
             'notes': pres.notes,
@@ -591,17 +714,149 @@ def settings():
 
 @app.route('/api/doctors_by_date')
 def doctors_by_date():
+    # Accepts either ?date=YYYY-MM-DD or ?start_date=...&end_date=..., plus an optional ?specialization=
     date_str = request.args.get('date')
-    if not date_str:
+    start_str = request.args.get('start_date', date_str)
+    end_str = request.args.get('end_date', start_str)
+    specialization = request.args.get('specialization') or None
+    if not start_str:
         return jsonify([])
     try:
-        selected_date = datetime.strptime(date_str, '%Y-%m-%d')
-        day_of_week = selected_date.weekday()
-        available_doctors = Doctor.query.join(DoctorAvailability).filter(DoctorAvailability.day_of_week == day_of_week).all()
-        doctor_list = [{'id': doc.id, 'name': doc.name, 'specialization': doc.specialization} for doc in available_doctors]
-        return jsonify(doctor_list)
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_str, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
+    span = (end_date - start_date).days + 1
+    if span < 1:
+        return jsonify({'error': 'end_date must not be before start_date'}), 400
+    if span > app.config['AVAILABILITY_MAX_RANGE_DAYS']:
+        return jsonify({'error': 'Date range too large'}), 400
+
+    dates = [start_date + timedelta(days=offset) for offset in range(span)]
+    available_doctors = availability_index.doctors_for_mask(days_to_mask(d.weekday() for d in dates), specialization)
+    if date_str and 'start_date' not in request.args:
+        doctor_list = [{'id': doc['id'], 'name': doc['name'], 'specialization': doc['specialization']}
+                       for doc in available_doctors]
+    else:
+        doctor_list = [{'id': doc['id'], 'name': doc['name'], 'specialization': doc['specialization'],
+                        'available_dates': [d.isoformat() for d in dates if d.weekday() in doc['days']]}
+                       for doc in available_doctors]
+    return jsonify(doctor_list)
+
+@app.route('/api/audit_log')
+@login_required
+def audit_log():
+    # Paginated, newest-first view of the audit trail with optional filters.
+    # Entries are written asynchronously, so the log is eventually consistent; a bounded
+    # flush first makes changes committed before this request visible in the common case.
+    audit_writer.flush()
+    query = AuditLog.query
+    table_name = request.args.get('table')
+    record_id = request.args.get('record_id', type=int)
+    actor_id = request.args.get('actor_id', type=int)
+    action = request.args.get('action')
+    if table_name:
+        query = query.filter(AuditLog.table_name == table_name)
+    if record_id is not None:
+        query = query.filter(AuditLog.record_id == record_id)
+    if actor_id is not None:
+        query = query.filter(AuditLog.actor_id == actor_id)
+    if action:
+        query = query.filter(AuditLog.action == action)
+    page = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).paginate(
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 50, type=int),
+        max_per_page=200,
+        error_out=False
+    )
+    return jsonify({
+        'page': page.page,
+        'per_page': page.per_page,
+        'total': page.total,
+        'pages': page.pages,
+        'entries': [{
+            'id': entry.id,
+            'table': entry.table_name,
+            'record_id': entry.record_id,
+            'action': entry.action,
+            'changes': json.loads(entry.changes) if entry.changes else {},
+            'actor_id': entry.actor_id,
+            'created_at': entry.created_at.isoformat()
+        } for entry in page.items]
+    })
+
+
+# --- REPORTING ROUTES ---
+
+def _income_by(session, column):
+    # Sums income across the hot and archive tiers, grouped by the given column name
+    totals = {}
+    for model in (Income, ArchivedIncome):
+        key = db.func.strftime('%Y-%m', model.date) if column == 'month' else getattr(model, column)
+        for group, amount in session.query(key, db.func.sum(model.amount)).group_by(key).all():
+            totals[group or 'Unknown'] = totals.get(group or 'Unknown', 0) + (amount or 0)
+    return totals
+
+@app.route('/api/reports/summary')
+@login_required
+def report_summary():
+    with reporting_session() as session:
+        outcomes = dict(session.query(Patient.status, db.func.count(Patient.id)).group_by(Patient.status).all())
+        income_by_source = _income_by(session, 'source')
+        income_by_month = _income_by(session, 'month')
+    return jsonify({
+        'patient_outcomes': outcomes,
+        'income_by_source': income_by_source,
+        'income_by_month': dict(sorted(income_by_month.items()))
+    })
+
+@app.route('/reports/income.csv')
+@login_required
+def export_income():
+    def generate():
+        # Rows are written and sent one at a time so memory stays flat however large the table is
+        output = io.StringIO()
+        writer = csv.writer(output)
+
+        def line(values):
+            output.seek(0)
+            output.truncate(0)
+            writer.writerow(values)
+            return output.getvalue()
+
+        yield line(['id', 'date', 'amount', 'source', 'patient_id', 'doctor_id', 'description', 'archived'])
+        with reporting_session() as session:
+            for model, archived in ((Income, False), (ArchivedIncome, True)):
+                for row in session.query(model).order_by(model.date).yield_per(500):
+                    yield line([history_ids(row)['id'], row.date.isoformat() if row.date else '', row.amount,
+                                row.source, row.patient_id, row.doctor_id, row.description, archived])
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=income.csv'})
+
+
+# --- CLI COMMANDS ---
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=None, help='Archive rows older than this many days.')
+@click.option('--batch-size', type=int, default=None, help='Rows moved per transaction.')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per table.')
+def archive_command(days, batch_size, pause, max_batches):
+    """Move old appointments, read messages and income rows to the archive tables."""
+    cutoff = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    counts = run_archival(cutoff=cutoff, batch_size=batch_size, pause=pause, max_batches=max_batches)
+    click.echo(f"Archived {counts['appointments']} appointments, {counts['messages']} messages "
+               f"and {counts['income']} income records.")
+
+
+@app.cli.command('snapshot')
+@click.option('--pages', type=int, default=None, help='Pages copied per backup step.')
+@click.option('--sleep', type=float, default=None, help='Seconds to pause between backup steps.')
+def snapshot_command(pages, sleep):
+    """Take an online snapshot of the live database."""
+    path = take_snapshot(pages=pages, sleep=sleep)
+    click.echo(f'Snapshot written to {path}')
 
 
 # --- MAIN EXECUTION BLOCK ---
@@ -0,0 +1,133 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, insert, delete, select, literal
+from audit import record_change
+from models import (db, Appointment, Prescription, Message, Income,
+                    ArchivedAppointment, ArchivedPrescription, ArchivedMessage, ArchivedIncome)
+
+# Appointment statuses that will never change again and can be moved to cold storage
+FINAL_APPOINTMENT_STATUSES = ('Completed', 'Rejected')
+
+
+def _copy_rows(source, target, ids, now):
+    """INSERT ... SELECT the rows of `source` whose id is in `ids` into `target`.
+
+    The archive row gets a fresh primary key; the source id is stored as original_id.
+    """
+    table = source.__table__
+    columns = [column.name for column in table.columns if column.name != 'id']
+    query = select(table.c.id, *[table.c[name] for name in columns], literal(now)).where(table.c.id.in_(ids))
+    db.session.execute(insert(target.__table__).from_select(['original_id'] + columns + ['archived_at'], query))
+
+
+def _move_appointments(ids, now):
+    _copy_rows(Appointment, ArchivedAppointment, ids, now)
+    # Prescriptions follow their appointment and are re-pointed at its new archive id.
+    # original_id plus this batch's archived_at identifies the row just inserted.
+    prescription = Prescription.__table__
+    archived = ArchivedAppointment.__table__
+    columns = [column.name for column in prescription.columns if column.name not in ('id', 'appointment_id')]
+    query = select(prescription.c.id, archived.c.id, *[prescription.c[name] for name in columns]).select_from(
+        prescription.join(archived, and_(archived.c.original_id == prescription.c.appointment_id,
+                                         archived.c.archived_at == literal(now)))
+    ).where(prescription.c.appointment_id.in_(ids))
+    db.session.execute(insert(ArchivedPrescription.__table__).from_select(
+        ['original_id', 'appointment_id'] + columns, query))
+    _record_moves(Appointment, ArchivedAppointment, now)
+    _record_moves(Prescription, ArchivedPrescription, now,
+                  ArchivedPrescription.appointment_id.in_(select(archived.c.id).where(archived.c.archived_at == literal(now))))
+    db.session.execute(delete(prescription).where(prescription.c.appointment_id.in_(ids)))
+    db.session.execute(delete(Appointment.__table__).where(Appointment.id.in_(ids)))
+
+
+def _record_moves(source, target, now, batch_filter=None):
+    # Core DELETEs bypass the ORM audit hooks, so log each move as old id -> archive id
+    if batch_filter is None:
+        batch_filter = target.archived_at == literal(now)
+    for original_id, archive_id in db.session.query(target.original_id, target.id).filter(batch_filter).all():
+        record_change(db.session, source.__tablename__, original_id,
+                      {'id': [original_id, archive_id], 'table': [source.__tablename__, target.__tablename__]},
+                      action='archive')
+
+
+def _move_simple(model, archive_model):
+    def move(ids, now):
+        _copy_rows(model, archive_model, ids, now)
+        db.session.execute(delete(model.__table__).where(model.id.in_(ids)))
+    return move
+
+
+def _archive_tier(name, candidates, move, batch_size, pause, max_batches, counts):
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [row[0] for row in db.session.execute(candidates.order_by('id').limit(batch_size))]
+        if not ids:
+            break
+        try:
+            move(ids, datetime.utcnow())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        counts[name] += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        # Give interactive requests a chance at the write lock between batches
+        time.sleep(pause)
+    return batches
+
+
+def run_archival(cutoff=None, batch_size=None, pause=None, max_batches=None):
+    """Move finished appointments, read messages and old income rows to the archive tables.
+
+    Each batch is copied and deleted in a single transaction, and archive rows get
+    their own keys, so the job can be interrupted at any point and simply re-run
+    to continue where it stopped, even after the hot tables have reused an id.
+    `max_batches` bounds the number of batches per tier for a single run.
+    Returns the number of rows moved per tier.
+    """
+    config = current_app.config
+    if cutoff is None:
+        cutoff = datetime.utcnow() - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    pause = config['ARCHIVE_BATCH_PAUSE'] if pause is None else pause
+
+    counts = {'appointments': 0, 'messages': 0, 'income': 0}
+    tiers = [
+        ('appointments',
+         select(Appointment.id).where(Appointment.status.in_(FINAL_APPOINTMENT_STATUSES),
+                                      Appointment.date < cutoff.strftime('%Y-%m-%d')),
+         _move_appointments),
+        ('messages',
+         select(Message.id).where(Message.is_read.is_(True), Message.created_at < cutoff),
+         _move_simple(Message, ArchivedMessage)),
+        ('income',
+         select(Income.id).where(Income.date < cutoff),
+         _move_simple(Income, ArchivedIncome)),
+    ]
+    for name, candidates, move in tiers:
+        _archive_tier(name, candidates, move, batch_size, pause, max_batches, counts)
+    return counts
+
+
+def merge_recent(queries, key, limit=None):
+    """Combine results from the hot and archive tiers, newest first by `key`."""
+    rows = []
+    for query in queries:
+        rows.extend(query.all())
+    rows.sort(key=lambda row: getattr(row, key) or datetime.min, reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+
+def history_ids(row):
+    """Identify a hot or archived row for JSON output.
+
+    `id` is always the id the record had in its hot table; archived rows also
+    carry their archive key as `archive_id`.
+    """
+    original_id = getattr(row, 'original_id', None)
+    if original_id is None:
+        return {'id': row.id, 'archived': False, 'archive_id': None}
+    return {'id': original_id, 'archived': True, 'archive_id': row.id}
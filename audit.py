@@ -0,0 +1,259 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import event, inspect
+from models import (db, AuditLog, Patient, Appointment, Prescription, MedicalRecord,
+                    Operation, Medication, ArchivedAppointment, ArchivedPrescription)
+
+logger = logging.getLogger(__name__)
+
+# Models whose inserts, updates and deletes are recorded in the audit trail
+AUDITED_MODELS = (Patient, Appointment, Prescription, MedicalRecord, Operation, Medication,
+                  ArchivedAppointment, ArchivedPrescription)
+
+_PENDING_KEY = 'audit_pending'
+
+
+def _serialize(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _current_actor_id():
+    # Only use a user Flask-Login has already loaded; loading one here would query mid-flush.
+    if has_request_context():
+        user = g.get('_login_user')
+        if user is not None and getattr(user, 'is_authenticated', False):
+            return user.id
+    return None
+
+
+def _column_diff(obj, action):
+    state = inspect(obj)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        key = attr.key
+        if action == 'insert':
+            value = state.dict.get(key)
+            if value is not None:
+                changes[key] = [None, _serialize(value)]
+        elif action == 'delete':
+            value = state.dict.get(key)
+            if value is not None:
+                changes[key] = [_serialize(value), None]
+        else:
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+            if old != new:
+                changes[key] = [_serialize(old), _serialize(new)]
+    return changes
+
+
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    actor_id = _current_actor_id()
+    now = datetime.utcnow()
+    for action, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, AUDITED_MODELS):
+                continue
+            changes = _column_diff(obj, action)
+            if action == 'update' and not changes:
+                continue
+            state = inspect(obj)
+            pending.append({
+                'table_name': obj.__tablename__,
+                'record_id': state.identity[0] if state.identity else state.dict.get('id'),
+                'action': action,
+                'changes': json.dumps(changes, default=str),
+                'actor_id': actor_id,
+                'created_at': now,
+            })
+
+
+def record_change(session, table_name, record_id, changes, action='update'):
+    """Add an audit entry for a change made with a bulk statement the ORM events cannot see.
+
+    The entry is queued with the rest of the session's changes when it commits.
+    """
+    session.info.setdefault(_PENDING_KEY, []).append({
+        'table_name': table_name,
+        'record_id': record_id,
+        'action': action,
+        'changes': json.dumps(changes, default=str),
+        'actor_id': _current_actor_id(),
+        'created_at': datetime.utcnow(),
+    })
+
+
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class AuditWriter:
+    """Background writer that batch-inserts audit entries off the request path.
+
+    Session events capture before/after diffs at flush time and hand them to
+    an in-process queue once the transaction commits. A daemon thread drains
+    the queue into the audit_log table in batches; the queue is bounded, and
+    when it is full the committing thread writes its entries inline instead of
+    growing memory without limit. Failed writes are retried with backoff and
+    then put back on the queue, and anything still queued is flushed at
+    interpreter shutdown.
+    """
+
+    def __init__(self, app=None):
+        self._queue = None
+        self._engine = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self.batch_size = 100
+        self.flush_interval = 1.0
+        self.flush_timeout = 2.0
+        self.write_retries = 5
+        self.retry_backoff = 0.1
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_QUEUE_SIZE', 10000)
+        app.config.setdefault('AUDIT_BATCH_SIZE', 100)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('AUDIT_FLUSH_TIMEOUT', 2.0)
+        app.config.setdefault('AUDIT_WRITE_RETRIES', 5)
+        app.config.setdefault('AUDIT_RETRY_BACKOFF', 0.1)  # seconds, doubled after each failed attempt
+        self.batch_size = app.config['AUDIT_BATCH_SIZE']
+        self.flush_interval = app.config['AUDIT_FLUSH_INTERVAL']
+        self.flush_timeout = app.config['AUDIT_FLUSH_TIMEOUT']
+        self.write_retries = app.config['AUDIT_WRITE_RETRIES']
+        self.retry_backoff = app.config['AUDIT_RETRY_BACKOFF']
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_QUEUE_SIZE'])
+        with app.app_context():
+            self._engine = db.engine
+
+        event.listen(db.session, 'after_flush', _collect_changes)
+        event.listen(db.session, 'after_commit', self._enqueue_committed)
+        event.listen(db.session, 'after_soft_rollback', lambda session, previous_transaction: _discard_changes(session))
+
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        app.extensions['audit'] = self
+
+    def _enqueue_committed(self, session):
+        entries = session.info.pop(_PENDING_KEY, None)
+        if not entries:
+            return
+        overflow = []
+        for index, entry in enumerate(entries):
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                overflow = entries[index:]
+                break
+        if overflow:
+            # The writer is falling behind; write inline rather than lose audit entries.
+            logger.warning('Audit queue full, writing %d entries synchronously', len(overflow))
+            self._write(overflow)
+
+    def _write(self, rows, requeue=False):
+        # Retry with backoff: the usual failure is a transient 'database is locked' while
+        # request transactions hold the SQLite write lock.
+        for attempt in range(self.write_retries + 1):
+            try:
+                with self._engine.begin() as conn:
+                    conn.execute(AuditLog.__table__.insert(), rows)
+                return True
+            except Exception:
+                if attempt == self.write_retries:
+                    break
+                logger.warning('Audit write failed, retrying (%d/%d)', attempt + 1, self.write_retries)
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+        unsaved = rows
+        if requeue:
+            # Put the batch back so the next drain tries again instead of dropping it
+            for index, row in enumerate(rows):
+                try:
+                    self._queue.put_nowait(row)
+                except queue.Full:
+                    unsaved = rows[index:]
+                    break
+            else:
+                unsaved = []
+        if unsaved:
+            logger.error('Failed to write %d audit entries: %s', len(unsaved),
+                             json.dumps(unsaved, default=str))
+        else:
+            logger.error('Audit write failed; %d entries re-queued', len(rows))
+        return False
+
+    def _drain(self, block):
+        batch = []
+        markers = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                # A flush() marker: write what was queued ahead of it now rather than at the deadline
+                markers.append(item)
+                break
+            batch.append(item)
+        if batch:
+            self._write(batch, requeue=block)
+        for marker in markers:
+            marker.set()
+        return len(batch) + len(markers)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._drain(block=True)
+
+    def flush(self, timeout=None):
+        """Wait, at most `timeout` seconds, until entries queued before the call are written.
+
+        A marker is queued behind those entries and the writer signals it once
+        everything ahead of it has been written, so entries added later do not
+        extend the wait. Returns False if the wait timed out or the queue was full.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._drain_all()
+            return True
+        marker = threading.Event()
+        try:
+            self._queue.put_nowait(marker)
+        except queue.Full:
+            return False
+        return marker.wait(self.flush_timeout if timeout is None else timeout)
+
+    def _drain_all(self):
+        while self._drain(block=False):
+            pass
+
+    def shutdown(self):
+        """Stop the writer thread and flush whatever is still queued."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=self.flush_interval * 2)
+        self._drain_all()
+        self._thread = None
+
+
+audit_writer = AuditWriter()
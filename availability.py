@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from models import Doctor, DoctorAvailability
+
+# Day of the week as used by DoctorAvailability: Monday=0, ..., Sunday=6
+ALL_DAYS_MASK = 0b1111111
+
+
+def days_to_mask(days):
+    """Pack an iterable of day_of_week integers into a 7-bit mask."""
+    mask = 0
+    for day in days:
+        mask |= 1 << int(day)
+    return mask & ALL_DAYS_MASK
+
+
+def mask_to_days(mask):
+    """Unpack a 7-bit mask into a sorted list of day_of_week integers."""
+    return [day for day in range(7) if mask & (1 << day)]
+
+
+_IndexState = namedtuple('_IndexState', ['masks', 'by_day', 'doctors', 'loaded_at'])
+
+
+class AvailabilityIndex:
+    """In-memory weekly availability, keyed by doctor and by day.
+
+    Built lazily from DoctorAvailability on first use and dropped again by
+    invalidate() whenever a doctor's schedule changes, so lookups that hit
+    the index never touch the database. invalidate() only reaches the current
+    process, so the index is also reloaded once it is older than
+    AVAILABILITY_INDEX_TTL seconds; other workers pick up a schedule change
+    within that window. The loaded data lives in a single
+    state object that is never mutated, only replaced, so a reader that takes
+    one reference sees a consistent snapshot even while another thread
+    invalidates or reloads the index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    def _load(self):
+        masks = {}
+        rows = DoctorAvailability.query.with_entities(
+            DoctorAvailability.doctor_id, DoctorAvailability.day_of_week).all()
+        for doctor_id, day in rows:
+            masks[doctor_id] = masks.get(doctor_id, 0) | (1 << day)
+        by_day = {day: frozenset(doctor_id for doctor_id, mask in masks.items() if mask & (1 << day))
+                  for day in range(7)}
+        doctors = {}
+        if masks:
+            for doc in Doctor.query.filter(Doctor.id.in_(masks.keys())).all():
+                doctors[doc.id] = {'id': doc.id, 'name': doc.name, 'specialization': doc.specialization}
+        return _IndexState(masks=masks, by_day=by_day, doctors=doctors, loaded_at=time.monotonic())
+
+    def _is_fresh(self, state):
+        return state is not None and time.monotonic() - state.loaded_at < current_app.config['AVAILABILITY_INDEX_TTL']
+
+    def _current_state(self):
+        state = self._state
+        if self._is_fresh(state):
+            return state
+        with self._lock:
+            if not self._is_fresh(self._state):
+                self._state = self._load()
+            return self._state
+
+    def mask_for(self, doctor_id):
+        return self._current_state().masks.get(doctor_id, 0)
+
+    def doctors_for_mask(self, mask, specialization=None):
+        """Return doctor dicts available on any day in `mask`, sorted by name."""
+        state = self._current_state()
+        doctor_ids = set()
+        for day in mask_to_days(mask):
+            doctor_ids |= state.by_day.get(day, frozenset())
+        results = []
+        for doctor_id in doctor_ids:
+            doctor = state.doctors.get(doctor_id)
+            if doctor is None:
+                continue
+            if specialization and (doctor['specialization'] or '').lower() != specialization.lower():
+                continue
+            results.append(dict(doctor, days=mask_to_days(state.masks[doctor_id] & mask)))
+        results.sort(key=lambda d: (d['name'], d['id']))
+        return results
+
+
+availability_index = AvailabilityIndex()
@@ -47,6 +47,14 @@ class Doctor(db.Model, UserMixin):
     def __repr__(self):
         return f'<Doctor {self.name}>'
 
+# Allowed appointment status changes: current status -> statuses it may move to
+APPOINTMENT_TRANSITIONS = {
+    'Pending': ('Accepted', 'Rejected'),
+    'Accepted': ('Completed',),
+    'Rejected': (),
+    'Completed': (),
+}
+
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.String(20), nullable=False)
@@ -84,6 +92,9 @@ class MedicalRecord(db.Model):
         return f'<MedicalRecord {self.filename}>'
     
 class DoctorAvailability(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_availability_doctor_day', 'doctor_id', 'day_of_week', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     # We will store the day of the week as an integer: Monday=0, Tuesday=1, ..., Sunday=6
     day_of_week = db.Column(db.Integer, nullable=False) 
@@ -159,4 +170,102 @@ class Document(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Document {self.original_filename}>'
\ No newline at end of file
+        return f'<Document {self.original_filename}>'
+
+# Cold-storage tables populated by archive.run_archival(). Each has its own primary key:
+# the hot tables reuse the highest id once its row is moved out, so the source row's id
+# is kept in original_id rather than as the key.
+class ArchivedAppointment(db.Model):
+    __tablename__ = 'archived_appointment'
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, index=True)
+    date = db.Column(db.String(20), nullable=False)
+    time = db.Column(db.String(20), nullable=False)
+    diagnosis = db.Column(db.Text)
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False, index=True)
+    # Relationships
+    patient = db.relationship('Patient', backref=db.backref('archived_appointments', lazy=True, cascade="all, delete-orphan"))
+    doctor = db.relationship('Doctor')
+    prescriptions = db.relationship('ArchivedPrescription', backref='appointment', lazy=True, cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f'<ArchivedAppointment {self.id} on {self.date}>'
+
+class ArchivedPrescription(db.Model):
+    __tablename__ = 'archived_prescription'
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, index=True)
+    medication = db.Column(db.String(100), nullable=False)
+    dosage = db.Column(db.String(100), nullable=False)
+    notes = db.Column(db.Text)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('archived_appointment.id'), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ArchivedPrescription {self.medication}>'
+
+class ArchivedMessage(db.Model):
+    __tablename__ = 'archived_message'
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, index=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), index=True)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), index=True)
+    subject = db.Column(db.String(200))
+    content = db.Column(db.Text, nullable=False)
+    is_read = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedMessage {self.id}>'
+
+class ArchivedIncome(db.Model):
+    __tablename__ = 'archived_income'
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    source = db.Column(db.String(100))
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'))
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'))
+    date = db.Column(db.DateTime)
+    description = db.Column(db.Text)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedIncome ${self.amount} from {self.source}>'
+
+
+class AuditLog(db.Model):
+    # Append-only trail of clinical mutations, written in batches by audit.AuditWriter
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_record', 'table_name', 'record_id'),
+        db.Index('ix_audit_log_created_at', 'created_at'),
+        db.Index('ix_audit_log_actor_id', 'actor_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    changes = db.Column(db.Text)  # JSON object of column -> [old, new]
+    actor_id = db.Column(db.Integer)  # Doctor who made the change, if known
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<AuditLog {self.action} {self.table_name}#{self.record_id}>'
+
+
+# Reject UPDATE/DELETE on the audit table at the database level so it stays append-only.
+for _operation in ('UPDATE', 'DELETE'):
+    db.event.listen(
+        AuditLog.__table__,
+        'after_create',
+        db.DDL(
+            f"CREATE TRIGGER IF NOT EXISTS audit_log_no_{_operation.lower()} "
+            f"BEFORE {_operation} ON audit_log "
+            f"BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END"
+        ).execute_if(dialect='sqlite'),
+    )
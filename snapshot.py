@@ -0,0 +1,148 @@
+import atexit
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from models import db
+
+logger = logging.getLogger(__name__)
+
+LATEST_SNAPSHOT_NAME = 'hospital-latest.db'
+REPORTING_BIND = 'reporting'
+
+
+def configure_reporting_bind(app):
+    """Register the read-only 'reporting' bind that points at the latest snapshot.
+
+    Must run before db.init_app(). NullPool makes every checkout reopen the file,
+    so a freshly swapped-in snapshot is picked up without restarting the app.
+    """
+    app.config.setdefault('SNAPSHOT_DIR', os.path.join(app.instance_path, 'snapshots'))
+    latest = os.path.join(app.config['SNAPSHOT_DIR'], LATEST_SNAPSHOT_NAME)
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    binds[REPORTING_BIND] = {'url': f'sqlite:///{latest}', 'poolclass': NullPool}
+
+
+def latest_snapshot_path():
+    return os.path.join(current_app.config['SNAPSHOT_DIR'], LATEST_SNAPSHOT_NAME)
+
+
+def take_snapshot(pages=None, sleep=None, keep=None):
+    """Copy the live database to a timestamped snapshot with SQLite's online backup API.
+
+    Pages are copied in batches of `pages` with `sleep` seconds between them, so
+    writers on the live database are only blocked for one batch at a time. The
+    finished snapshot becomes the new 'latest' file used by the reporting bind,
+    and only the newest `keep` timestamped snapshots are retained.
+    Returns the path of the new snapshot.
+    """
+    config = current_app.config
+    pages = pages or config['SNAPSHOT_PAGES']
+    sleep = config['SNAPSHOT_SLEEP'] if sleep is None else sleep
+    keep = keep or config['SNAPSHOT_KEEP']
+    snapshot_dir = config['SNAPSHOT_DIR']
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    source_path = db.engine.url.database
+    snapshot_path = os.path.join(snapshot_dir, f"hospital-{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}.db")
+    fd, temp_path = tempfile.mkstemp(suffix='.db.tmp', dir=snapshot_dir)
+    os.close(fd)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+    except Exception:
+        target.close()
+        os.remove(temp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(temp_path, snapshot_path)
+
+    _publish_latest(snapshot_path, snapshot_dir)
+    _prune_snapshots(snapshot_dir, keep)
+    return snapshot_path
+
+
+def _publish_latest(snapshot_path, snapshot_dir):
+    # Swap the file atomically so reporting connections never see a half-written copy
+    fd, temp_path = tempfile.mkstemp(suffix='.db.tmp', dir=snapshot_dir)
+    os.close(fd)
+    os.remove(temp_path)
+    try:
+        os.link(snapshot_path, temp_path)
+    except OSError:
+        shutil.copy2(snapshot_path, temp_path)
+    os.replace(temp_path, os.path.join(snapshot_dir, LATEST_SNAPSHOT_NAME))
+
+
+def _prune_snapshots(snapshot_dir, keep):
+    snapshots = sorted(name for name in os.listdir(snapshot_dir)
+                       if name.startswith('hospital-') and name.endswith('.db') and name != LATEST_SNAPSHOT_NAME)
+    for name in snapshots[:-keep]:
+        try:
+            os.remove(os.path.join(snapshot_dir, name))
+        except OSError:
+            logger.warning('Could not remove old snapshot %s', name)
+
+
+@contextmanager
+def reporting_session():
+    """Session for heavy read-only reporting queries.
+
+    Uses the latest snapshot when REPORTING_USE_SNAPSHOT is enabled and a snapshot
+    exists, and falls back to the primary database session otherwise.
+    """
+    if current_app.config['REPORTING_USE_SNAPSHOT'] and os.path.exists(latest_snapshot_path()):
+        session = Session(db.engines[REPORTING_BIND])
+        session.execute(text('PRAGMA query_only = ON'))
+        try:
+            yield session
+        finally:
+            session.close()
+    else:
+        yield db.session
+
+
+class SnapshotScheduler:
+    """Daemon thread that takes a snapshot every SNAPSHOT_INTERVAL seconds (0 disables it)."""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._thread = None
+        self._stopping = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        app.extensions['snapshot_scheduler'] = self
+        if app.config['SNAPSHOT_INTERVAL'] <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='snapshot-scheduler', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def _run(self):
+        interval = self._app.config['SNAPSHOT_INTERVAL']
+        while not self._stopping.wait(interval):
+            with self._app.app_context():
+                try:
+                    take_snapshot()
+                except Exception:
+                    logger.exception('Scheduled database snapshot failed')
+
+    def shutdown(self):
+        self._stopping.set()
+
+
+snapshot_scheduler = SnapshotScheduler()